@@ -7,19 +7,20 @@
 
 import re
 import time
-from copy import deepcopy
+from enum import Enum
+from functools import lru_cache
 
 import json
 import yaml
 
 try:
-    from yaml import CLoader as Loader
+    from yaml import CSafeLoader as Loader
 except ImportError:
-    from yaml import Loader
+    from yaml import SafeLoader as Loader
+from pydantic import ValidationError
 from troposphere import Template
 from troposphere import Ref, Sub, GetAtt
 from troposphere import AWS_NO_VALUE
-from cfn_tools import CfnYamlLoader
 
 from aws_custom_ews_kafka_resources import KafkaAclPolicy
 from aws_custom_ews_kafka_resources.custom import (
@@ -36,8 +37,6 @@ from aws_custom_ews_kafka_resources.resource import (
 from .model import (
     Model,
     EwsKafkaParmeters,
-    Topics,
-    ACLs,
     SecurityProtocol,
     SASLMechanism,
 )
@@ -56,6 +55,30 @@ from .model import (
 )
 
 NONALPHANUM = re.compile(r"([^a-zA-Z0-9]+)")
+POLICY_DEFAULTS = {
+    name: field.default
+    for name, field in Policy.__fields__.items()
+    if not field.required
+}
+
+
+@lru_cache(maxsize=None)
+def _enum_value(value, enum_class):
+    """
+    Function to get the value of the enum_class member matching value.
+    Fields left to their default are the raw value, not the enum member, and
+    some models use a copy of an enum (i.e. CompatibilityMode1) matched by name.
+
+    :param value: The enum member, or its raw value
+    :param enum_class: The enum to get the member value from
+    :return: The member value
+    :rtype: str
+    """
+    if isinstance(value, enum_class):
+        return value.value
+    elif isinstance(value, Enum):
+        return enum_class[value.name].value
+    return enum_class(value).value
 
 
 def keyisset(x, y):
@@ -70,7 +93,7 @@ def keyisset(x, y):
     :returns: True/False
     :rtype: bool
     """
-    if isinstance(y, dict) and x in y.keys() and y[x]:
+    if isinstance(y, dict) and y.get(x):
         return True
     return False
 
@@ -87,11 +110,26 @@ def keypresent(x, y):
     :returns: True/False
     :rtype: bool
     """
-    if isinstance(y, dict) and x in y.keys():
+    if isinstance(y, dict) and x in y:
         return True
     return False
 
 
+def _load_schema_definition(definition_path):
+    """
+    Function to load the JSON schema definition from the given file.
+
+    :param str definition_path: Path to the schema definition file
+    :return: The compacted JSON definition, None if the file does not exist
+    :rtype: str
+    """
+    try:
+        with open(definition_path, "r") as definition_fd:
+            return json.dumps(json.load(definition_fd))
+    except FileNotFoundError:
+        return None
+
+
 def merge_topics(final, override, extend_config_only=False):
     """
     Function to override and update settings from override to primary
@@ -102,29 +140,33 @@ def merge_topics(final, override, extend_config_only=False):
     :return: The final merged dict
     :rtype: dict
     """
-    if keyisset("Topics", override):
-        override_top_topics = Topics.parse_obj(override["Topics"]).dict()
+    if override.get("Topics"):
+        if not isinstance(override["Topics"], dict):
+            raise ValueError("Topics: value is not a valid dict")
+        override_top_topics = dict(override["Topics"])
+        override_topics = override_top_topics.pop("Topics", None)
         if extend_config_only:
             # Allows to add the config and ensure that we do not import topics from config
-            if keypresent("Topics", override_top_topics):
-                del override_top_topics["Topics"]
             final["Topics"].update(override_top_topics)
-        elif not extend_config_only and keyisset("Topics", override_top_topics):
-            if keyisset("Topics", final["Topics"]):
-                existing_topics = deepcopy(final["Topics"]["Topics"])
-                override_topics = deepcopy(override_top_topics["Topics"])
-                merged_lists = override_topics + existing_topics
-                del final["Topics"]["Topics"]
-                del override_top_topics["Topics"]
-                topics = list({v["Name"]: v for v in merged_lists}.values())
-                final["Topics"].update(override_top_topics)
-                final["Topics"]["Topics"] = topics
-            elif not keypresent("Topics", final["Topics"]):
-                override_topics = deepcopy(override_top_topics["Topics"])
-                del override_top_topics["Topics"]
-                topics = list({v["Name"]: v for v in override_topics}.values())
-                final["Topics"].update(override_top_topics)
-                final["Topics"]["Topics"] = topics
+        elif override_topics:
+            if not isinstance(override_topics, list):
+                raise ValueError("Topics -> Topics: value is not a valid list")
+            for index, topic in enumerate(override_topics):
+                if not isinstance(topic, dict):
+                    raise ValueError(
+                        f"Topics -> Topics -> {index}: value is not a valid dict"
+                    )
+                if "Name" not in topic:
+                    raise ValueError(
+                        f"Topics -> Topics -> {index} -> Name: field required"
+                    )
+            existing_topics = final["Topics"].pop("Topics", None) or []
+            final["Topics"].update(override_top_topics)
+            # Names compared as str, raw YAML scalars (i.e. Name: 2021) are unvalidated
+            merged_topics = {
+                str(topic["Name"]): topic for topic in existing_topics + override_topics
+            }
+            final["Topics"]["Topics"] = list(merged_topics.values())
 
 
 def merge_acls(final, override, extend_all=False):
@@ -138,53 +180,68 @@ def merge_acls(final, override, extend_all=False):
     :return: The final merged dict
     :rtype: dict
     """
-    if keyisset("ACLs", override):
-        override_acls = ACLs.parse_obj(override["ACLs"]).dict()
-        if keypresent("Policies", override_acls) and not extend_all:
-            del override_acls["Policies"]
+    if override.get("ACLs"):
+        if not isinstance(override["ACLs"], dict):
+            raise ValueError("ACLs: value is not a valid dict")
+        override_acls = dict(override["ACLs"])
+        override_policies = override_acls.pop("Policies", None)
+        if not extend_all:
             final["ACLs"].update(override_acls)
-        elif keyisset("Policies", override_acls) and extend_all:
-            if keyisset("Policies", final["ACLs"]):
-                merged_lists = override_acls["Policies"] + final["ACLs"]["Policies"]
+        elif override_policies:
+            if not isinstance(override_policies, list):
+                raise ValueError("ACLs -> Policies: value is not a valid list")
+            for index, policy in enumerate(override_policies):
+                if not isinstance(policy, dict):
+                    raise ValueError(
+                        f"ACLs -> Policies -> {index}: value is not a valid dict"
+                    )
+            if final["ACLs"].get("Policies"):
+                merged_lists = override_policies + final["ACLs"]["Policies"]
             else:
-                merged_lists = override_acls["Policies"]
-            acls = [dict(y) for y in set(tuple(x.items()) for x in merged_lists)]
+                merged_lists = override_policies
+            try:
+                # Policies differing only by an explicit default are duplicates
+                acls = list(
+                    {
+                        frozenset({**POLICY_DEFAULTS, **x}.items()): x
+                        for x in merged_lists
+                    }.values()
+                )
+            except TypeError:
+                raise ValueError("ACLs -> Policies: properties must be single values")
             final["ACLs"].update(override_acls)
             final["ACLs"]["Policies"] = acls
 
 
-def merge_contents(primary, override, extend_all=False):
+def merge_contents_into(final, override, extend_all=False):
     """
-    Function to override and update settings from override to primary
-    :param primary:
-    :param override:
+    Function to override and update settings from override into final, in place
+    :param dict final:
+    :param dict override:
     :param extend_all: Whether the policies or ACLs can be merged.
-    :return: The final merged dict
-    :rtype: dict
     """
     if not isinstance(override, dict):
         raise TypeError(
             "The content of the override file does not match the expected content pattern."
         )
-    final = dict(deepcopy(primary))
     if (
-        keypresent("Globals", final)
-        and keyisset("Globals", override)
+        "Globals" in final
+        and override.get("Globals")
         and isinstance(override["Globals"], dict)
     ):
         override_globals = EwsKafkaParmeters.parse_obj(override["Globals"])
         final["Globals"].update(override_globals.dict())
 
     if (
-        keypresent("Schemas", final)
-        and keyisset("Schemas", override)
+        "Schemas" in final
+        and override.get("Schemas")
         and isinstance(override["Schemas"], dict)
     ):
         override_globals = SchemasDef.parse_obj(override["Schemas"])
         final["Schemas"].update(override_globals.dict())
     elif (
-        not keypresent("Schemas", final)
-        and keyisset("Schemas", override)
+        "Schemas" not in final
+        and override.get("Schemas")
         and isinstance(override["Schemas"], dict)
     ):
         override_globals = SchemasDef.parse_obj(override["Schemas"])
@@ -192,6 +249,19 @@ def merge_contents(primary, override, extend_all=False):
 
     merge_acls(final, override, extend_all)
     merge_topics(final, override, not extend_all)
+
+
+def merge_contents(primary, override, extend_all=False):
+    """
+    Function to override and update settings from override to primary
+    :param primary:
+    :param override:
+    :param extend_all: Whether the policies or ACLs can be merged.
+    :return: The final merged dict
+    :rtype: dict
+    """
+    final = {k: (v.copy() if isinstance(v, dict) else v) for k, v in primary.items()}
+    merge_contents_into(final, override, extend_all)
     return final
 
 
@@ -209,20 +279,28 @@ class KafkaStack(object):
         self.schemas_r = {}
         self.topics_r = {}
         self.globals_config = {}
+        self._schema_definitions = {}
         final_content = {"Globals": {}, "Topics": {}, "ACLs": {}}
         for file_path in files_paths:
-            if file_path.endswith(".yaml") or file_path.endswith(".yml"):
-                with open(file_path, "r") as file_fd:
-                    file_content = file_fd.read()
-                yaml_content = yaml.load(file_content, Loader=Loader)
-                final_content = merge_contents(
-                    final_content, yaml_content, extend_all=True
-                )
+            if not file_path.endswith((".yaml", ".yml")):
+                continue
+            with open(file_path, "rb") as file_fd:
+                yaml_content = yaml.load(file_fd, Loader=Loader)
+            try:
+                merge_contents_into(final_content, yaml_content, extend_all=True)
+            except ValidationError:
+                raise
+            except ValueError as error:
+                raise ValueError(f"{file_path}: {error}") from error
         if config_file_path:
-            with open(config_file_path, "r") as override_fd:
-                override_content = override_fd.read()
-            override_content = yaml.load(override_content, Loader=Loader)
-            final_content = merge_contents(final_content, override_content)
+            with open(config_file_path, "rb") as override_fd:
+                override_content = yaml.load(override_fd, Loader=Loader)
+            try:
+                merge_contents_into(final_content, override_content)
+            except ValidationError:
+                raise
+            except ValueError as error:
+                raise ValueError(f"{config_file_path}: {error}") from error
         self.model = Model.parse_obj(final_content)
 
         if not self.model.Topics and not self.model.ACLs:
@@ -233,25 +311,22 @@ class KafkaStack(object):
         """
         Method to set the global settings
         """
+        globals_model = self.model.Globals
         self.globals_config.update(
             {
-                "BootstrapServers": self.model.Globals.BootstrapServers,
-                "SASLUsername": self.model.Globals.SASLUsername
-                if self.model.Globals.SASLUsername
+                "BootstrapServers": globals_model.BootstrapServers,
+                "SASLUsername": globals_model.SASLUsername
+                if globals_model.SASLUsername
                 else Ref(AWS_NO_VALUE),
-                "SASLPassword": self.model.Globals.SASLPassword
-                if self.model.Globals.SASLPassword
+                "SASLPassword": globals_model.SASLPassword
+                if globals_model.SASLPassword
                 else Ref(AWS_NO_VALUE),
-                "SASLMechanism": SASLMechanism[
-                    self.model.Globals.SASLMechanism.name
-                ].value
-                if isinstance(self.model.Globals.SASLMechanism, SASLMechanism)
-                else self.model.Globals.SASLMechanism,
-                "SecurityProtocol": SecurityProtocol[
-                    self.model.Globals.SecurityProtocol.name
-                ].value
-                if isinstance(self.model.Globals.SecurityProtocol, SecurityProtocol)
-                else self.model.Globals.SecurityProtocol,
+                "SASLMechanism": _enum_value(
+                    globals_model.SASLMechanism, SASLMechanism
+                ),
+                "SecurityProtocol": _enum_value(
+                    globals_model.SecurityProtocol, SecurityProtocol
+                ),
             }
         )
 
@@ -268,7 +343,7 @@ class KafkaStack(object):
         schema_config = schema_definition.dict()
         if self.model.Schemas and self.model.Schemas.RegistryUrl:
             registry_url = self.model.Schemas.RegistryUrl
-        elif keyisset("RegistryUrl", schema_config):
+        elif schema_config.get("RegistryUrl"):
             registry_url = schema_config["RegistryUrl"]
         else:
             raise KeyError(
@@ -276,42 +351,45 @@ class KafkaStack(object):
             )
         if self.model.Schemas and self.model.Schemas.RegistryUsername:
             registry_username = self.model.Schemas.RegistryUsername
-        elif keyisset("RegistryUsername", schema_config):
+        elif schema_config.get("RegistryUsername"):
             registry_username = schema_config["RegistryUsername"]
         else:
             registry_username = Ref(AWS_NO_VALUE)
         if self.model.Schemas and self.model.Schemas.RegistryPassword:
             registry_password = self.model.Schemas.RegistryPassword
-        elif keyisset("RegistryPassword", schema_config):
+        elif schema_config.get("RegistryPassword"):
             registry_password = schema_config["RegistryPassword"]
         else:
             registry_password = Ref(AWS_NO_VALUE)
 
         if isinstance(schema_definition.Definition, str):
-            try:
-                with open(schema_definition.Definition, "r") as definition_fd:
-                    definition = json.dumps(json.loads(definition_fd.read()))
-            except FileNotFoundError:
+            if schema_definition.Definition not in self._schema_definitions:
+                self._schema_definitions[
+                    schema_definition.Definition
+                ] = _load_schema_definition(schema_definition.Definition)
+            definition = self._schema_definitions[schema_definition.Definition]
+            if definition is None:
                 print("Failed to load file, using string literal as definition")
                 definition = schema_definition.Definition
         else:
             definition = schema_definition.Definition
 
+        schema_type = _enum_value(schema_definition.Type, SchemaType)
+        serialize_attribute = _enum_value(
+            schema_definition.SerializeAttribute, SerializeAttribute
+        )
         topic_schema_r = schema_class(
-            f"{topic_name}{SchemaType[schema_definition.Type.name].value}"
-            f"{SerializeAttribute[schema_definition.SerializeAttribute.name].value}Schema",
-            SerializeAttribute=SerializeAttribute[
-                schema_definition.SerializeAttribute.name
-            ].value,
-            Type=SchemaType[schema_definition.Type.name].value,
+            f"{topic_name}{schema_type}{serialize_attribute}Schema",
+            SerializeAttribute=serialize_attribute,
+            Type=schema_type,
             Definition=definition,
             Subject=Ref(topic_name),
             RegistryUrl=registry_url,
             RegistryUsername=registry_username,
             RegistryPassword=registry_password,
-            CompatibilityMode=CompatibilityMode[
-                schema_definition.CompatibilityMode.name
-            ].value,
+            CompatibilityMode=_enum_value(
+                schema_definition.CompatibilityMode, CompatibilityMode
+            ),
         )
         self.schemas_r[topic_name] = topic_schema_r
         self.template.add_resource(topic_schema_r)
@@ -331,40 +409,53 @@ class KafkaStack(object):
                     f"{self.model.Topics.FunctionName}"
                 )
             )
+        default_replication_factor = (
+            self.model.Topics.ReplicationFactor.__root__
+            if self.model.Topics.ReplicationFactor
+            else None
+        )
+        deletion_policy = _enum_value(self.model.Topics.DeletionPolicy, DeletionPolicy)
         for topic in self.model.Topics.Topics:
-            topic_cfg = topic.dict()
+            topic_title_raw = topic.Name.__root__
+            if topic.ReplicationFactor:
+                replication_factor = topic.ReplicationFactor.__root__
+            elif default_replication_factor is not None:
+                replication_factor = default_replication_factor
+            else:
+                raise KeyError(
+                    f"ReplicationFactor is not defined for topic {topic_title_raw} "
+                    "nor in Topics"
+                )
+            topic_cfg = {
+                **self.globals_config,
+                "Name": topic_title_raw,
+                "PartitionsCount": topic.PartitionsCount.__root__,
+                "ReplicationFactor": replication_factor,
+            }
             if function_name:
-                topic_cfg.update({"ServiceToken": function_name})
-            topic_cfg.update(self.globals_config)
-            topic_cfg.update(
-                {
-                    "ReplicationFactor": self.model.Topics.ReplicationFactor.__root__
-                    if not topic.ReplicationFactor
-                    else topic.ReplicationFactor,
-                }
+                topic_cfg["ServiceToken"] = function_name
+            settings = topic.Settings.dict() if topic.Settings else None
+            if settings:
+                topic_cfg["Settings"] = settings
+            topic_title = (
+                topic_title_raw.replace("-", "")
+                .title()
+                .replace(".", "")
+                .replace("_", "")
             )
-            if not keyisset("Settings", topic_cfg) and keypresent(
-                "Settings", topic_cfg
-            ):
-                del topic_cfg["Settings"]
-            topic_title_raw = topic.Name.__root__
-            topic_title = topic_title_raw.replace("-", "").title()
-            topic_title = NONALPHANUM.sub("", topic_title)
-            if topic.Schema and keyisset("Schema", topic_cfg):
-                # self.add_topic_schema(topic_title, topic.Schema)
-                del topic_cfg["Schema"]
-            if keypresent("Schema", topic_cfg):
-                del topic_cfg["Schema"]
+            if not topic_title.isalnum():
+                # i.e. trailing newline, which the Name pattern $ anchor lets through
+                topic_title = NONALPHANUM.sub("", topic_title)
+            # if topic.Schema:
+            #     self.add_topic_schema(topic_title, topic.Schema)
             topic_r = self.template.add_resource(
                 self.topic_class(
                     topic_title,
-                    DeletionPolicy=DeletionPolicy[
-                        self.model.Topics.DeletionPolicy.name
-                    ].value,
+                    DeletionPolicy=deletion_policy,
                     **topic_cfg,
                 )
             )
-            self.topics_r[topic.Name.__root__] = topic_r
+            self.topics_r[topic_title_raw] = topic_r
 
     def import_topic_name(self, policy):
         """
@@ -373,10 +464,10 @@ class KafkaStack(object):
         :param Policy policy:
         :return:
         """
-        if policy.ResourceType.value == ResourceType.TOPIC.name:
-            topic_name = policy.Resource
-            if topic_name in self.topics_r.keys():
-                return GetAtt(self.topics_r[policy.Resource], "Name")
+        if policy.ResourceType is ResourceType.TOPIC:
+            topic_r = self.topics_r.get(policy.Resource)
+            if topic_r is not None:
+                return GetAtt(topic_r, "Name")
         return policy.Resource
 
     def render_acls(self):
@@ -393,26 +484,20 @@ class KafkaStack(object):
                     f"{self.model.ACLs.FunctionName}"
                 )
             )
-        acl = {}
-        acl.update(self.globals_config)
+        acl = {**self.globals_config}
         if function_name:
-            acl.update({"ServiceToken": function_name})
-
-        policies = []
-        for policy in self.model.ACLs.Policies:
-            if isinstance(policy.PatternType, str):
-                pattern_key = policy.PatternType
-            else:
-                pattern_key = policy.PatternType.name
-            policies.append(
-                KafkaAclPolicy(
-                    Resource=self.import_topic_name(policy),
-                    ResourceType=ResourceType[policy.ResourceType.name].value,
-                    Principal=policy.Principal,
-                    PatternType=PatternType[pattern_key].value,
-                    Action=Action[policy.Action.name].value,
-                    Effect=Effect[policy.Effect.name].value,
-                    Host=policy.Host if policy.Host else r"*",
-                )
+            acl["ServiceToken"] = function_name
+
+        policies = [
+            KafkaAclPolicy(
+                Resource=self.import_topic_name(policy),
+                ResourceType=_enum_value(policy.ResourceType, ResourceType),
+                Principal=policy.Principal,
+                PatternType=_enum_value(policy.PatternType, PatternType),
+                Action=_enum_value(policy.Action, Action),
+                Effect=_enum_value(policy.Effect, Effect),
+                Host=policy.Host if policy.Host else r"*",
             )
+            for policy in self.model.ACLs.Policies
+        ]
         self.template.add_resource(self.acl_class("ACLs", Policies=policies, **acl))
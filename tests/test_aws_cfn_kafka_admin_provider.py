@@ -4,9 +4,14 @@
 
 from os import path
 import pytest
+from pydantic import ValidationError
 
 
-from aws_cfn_kafka_admin_provider.aws_cfn_kafka_admin_provider import KafkaStack
+from aws_cfn_kafka_admin_provider.aws_cfn_kafka_admin_provider import (
+    KafkaStack,
+    merge_topics,
+)
+from aws_cfn_kafka_admin_provider.model import Schema, SchemasDef
 
 
 def test_valid_custom_resource_input():
@@ -53,3 +58,176 @@ def test_invalid_private_resource_input():
         c = KafkaStack(f"{here}/invalid_input_resource.yaml")
         c.render_topics()
         c.template.to_yaml()
+
+
+def test_merge_topics_override_wins():
+    """
+    Function to test that topics from the override take precedence over existing ones
+    :return:
+    """
+    final = {
+        "Topics": {
+            "Topics": [
+                {"Name": "topic-b", "PartitionsCount": 1},
+                {"Name": "topic-a", "PartitionsCount": 1},
+            ]
+        }
+    }
+    override = {
+        "Topics": {
+            "Topics": [
+                {"Name": "topic-c", "PartitionsCount": 2},
+                {"Name": "topic-a", "PartitionsCount": 2},
+            ]
+        }
+    }
+    merge_topics(final, override)
+    assert final["Topics"]["Topics"] == [
+        {"Name": "topic-b", "PartitionsCount": 1},
+        {"Name": "topic-a", "PartitionsCount": 2},
+        {"Name": "topic-c", "PartitionsCount": 2},
+    ]
+
+
+def test_merge_topics_keeps_unset_settings():
+    """
+    Function to test that merging topics keeps settings the override does not define
+    :return:
+    """
+    final = {
+        "Topics": {
+            "FunctionName": "topics-function",
+            "ReplicationFactor": 3,
+            "Topics": [{"Name": "topic-a", "PartitionsCount": 1}],
+        }
+    }
+    merge_topics(
+        final, {"Topics": {"Topics": [{"Name": "topic-b", "PartitionsCount": 1}]}}
+    )
+    assert final["Topics"]["FunctionName"] == "topics-function"
+    assert final["Topics"]["ReplicationFactor"] == 3
+    assert len(final["Topics"]["Topics"]) == 2
+
+
+def test_numeric_topic_names():
+    """
+    Function to test that topic names parsed as numbers are merged and rendered
+    :return:
+    """
+    here = path.abspath(path.dirname(__file__))
+    c = KafkaStack([f"{here}/valid_input_numeric_names.yaml"])
+    c.render_topics()
+    resources = c.template.to_dict()["Resources"]
+    assert resources["2021"]["Properties"]["Name"] == "2021"
+    assert resources["Abc"]["Properties"]["Name"] == "abc"
+
+    final = {"Topics": {"Topics": [{"Name": 2021, "PartitionsCount": 1}]}}
+    merge_topics(
+        final, {"Topics": {"Topics": [{"Name": "2021", "PartitionsCount": 2}]}}
+    )
+    assert final["Topics"]["Topics"] == [{"Name": "2021", "PartitionsCount": 2}]
+
+
+def test_topic_title_strips_trailing_newline():
+    """
+    Function to test that a block scalar topic name still renders a valid title
+    :return:
+    """
+    here = path.abspath(path.dirname(__file__))
+    c = KafkaStack([f"{here}/valid_input_multiline_name.yaml"])
+    c.render_topics()
+    assert list(c.template.to_dict()["Resources"]) == ["Mytopic"]
+
+
+def test_merge_topics_invalid_topics():
+    """
+    Function to test that topics without a Name are rejected, but a Name of 0 is not
+    :return:
+    """
+    final = {"Topics": {}}
+    with pytest.raises(ValueError, match=r"Topics -> Topics -> 1 -> Name"):
+        merge_topics(
+            final,
+            {"Topics": {"Topics": [{"Name": "a"}, {"PartitionsCount": 1}]}},
+        )
+    merge_topics(final, {"Topics": {"Topics": [{"Name": 0, "PartitionsCount": 1}]}})
+    assert final["Topics"]["Topics"] == [{"Name": 0, "PartitionsCount": 1}]
+
+
+def test_merge_acls_explicit_defaults():
+    """
+    Function to test that policies differing only by an explicit default are merged
+    :return:
+    """
+    here = path.abspath(path.dirname(__file__))
+    c = KafkaStack(
+        [
+            f"{here}/valid_input_acls.yaml",
+            f"{here}/valid_input_acls_explicit_defaults.yaml",
+        ]
+    )
+    assert len(c.model.ACLs.Policies) == 1
+
+
+def test_invalid_globals_raise_validation_error(tmp_path):
+    """
+    Function to test that model validation errors from merging are not wrapped
+    :return:
+    """
+    input_path = tmp_path / "invalid_globals.yaml"
+    input_path.write_text("Globals:\n  SecurityProtocol: NOTAPROTOCOL\n")
+    with pytest.raises(ValidationError):
+        KafkaStack([str(input_path)])
+
+
+def test_topic_replication_factor():
+    """
+    Function to test that a topic ReplicationFactor is rendered as an integer
+    :return:
+    """
+    here = path.abspath(path.dirname(__file__))
+    c = KafkaStack([f"{here}/valid_input_topic_replication_factor.yaml"])
+    c.render_topics()
+    resources = c.template.to_dict()["Resources"]
+    assert resources["Newtopic01"]["Properties"]["ReplicationFactor"] == 2
+    assert resources["Newtopic02"]["Properties"]["ReplicationFactor"] == 3
+
+
+def test_topic_missing_replication_factor(tmp_path):
+    """
+    Function to test that a topic without any ReplicationFactor is reported by name
+    :return:
+    """
+    input_path = tmp_path / "no_replication_factor.yaml"
+    input_path.write_text(
+        "Globals:\n"
+        "  BootstrapServers: broker.cluster.internal\n"
+        "Topics:\n"
+        "  DeletionPolicy: Retain\n"
+        "  Topics:\n"
+        "    - Name: new-topic-01\n"
+        "      PartitionsCount: 1\n"
+    )
+    c = KafkaStack([str(input_path)])
+    with pytest.raises(KeyError, match="new-topic-01"):
+        c.render_topics()
+
+
+def test_schema_definitions_cache_per_stack(tmp_path):
+    """
+    Function to test that schema definition files are not cached across stacks
+    :return:
+    """
+    here = path.abspath(path.dirname(__file__))
+    definition_path = tmp_path / "schema.json"
+    schema = Schema(Type="JSON", Definition=str(definition_path))
+    c = KafkaStack([f"{here}/valid_input_numeric_names.yaml"])
+    c.model.Schemas = SchemasDef(RegistryUrl="http://registry.internal")
+    c.add_topic_schema("Abc", schema)
+    assert c._schema_definitions[str(definition_path)] is None
+
+    definition_path.write_text('{"type": "string"}')
+    c = KafkaStack([f"{here}/valid_input_numeric_names.yaml"])
+    c.model.Schemas = SchemasDef(RegistryUrl="http://registry.internal")
+    c.add_topic_schema("Abc", schema)
+    assert c._schema_definitions[str(definition_path)] == '{"type": "string"}'